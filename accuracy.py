@@ -1,33 +1,50 @@
 from math import log
 from math import isclose
 import numpy as np
-from scipy.integrate import quad
-from scipy.optimize import root
+import os
+from scipy.interpolate import RegularGridInterpolator
+from scipy.special import xlogy
 
 from matplotlib import pyplot as plt
 
 from algorithms import *
 
 
+# Gauss-Legendre rule and negligible tail in multiples of the scale for `probability_precise`
+nodes, weights = np.polynomial.legendre.leggauss(20)
+TAIL = 50
+# halving [log(SMALLEST), log(b)] this often resolves any beta to relative machine precision
+BISECTIONS = 64
+SMALLEST = np.finfo(float).tiny
+# precomputed lookup table for `probability_precise`, loaded on first use
+TABLE = 'data/probability_precise.npz'
+TINY = 1e-300
+# relative positions of the error probes within each table cell, and margin on their maximum
+PROBES = (0.25, 0.5, 0.75)
+SAFETY = 2
+table = None
+
+
 def accuracy_threshold(b1, s1):
     # we use factor two because a1 = a2 = a/2
-    return -2*s1*log(b1)
+    return -2*s1*np.log(b1)
 
 
 def accuracy_queries(b2, k, s2):
     # we use factor two because a1 = a2 = a/2
-    return -2*s2*(log(b2/k))
+    return -2*s2*(np.log(b2/k))
 
 
 def accuracy_queries_improved(b2, k, s2):
-    return -2*s2*log(1 - (1 - b2)**(1/k))
+    # 1 - (1 - b2)**(1/k), without rounding to zero for tiny b2
+    return -2*s2*np.log(-np.expm1(np.log1p(-b2)/k))
 
 
 def accuracy_overestimate(b, k, s1, s2):
     # the definition in [@privacybook, p. 60] is only valid for
     # e1 = e2 = e/2, sensitivity = 1, monotonic = False.
     # here we only assume a1 = a2 = a/2 and b1 = b2 = b/2
-    return max(accuracy_threshold(b/2, s1), accuracy_queries(b/2, k, s2))
+    return np.maximum(accuracy_threshold(b/2, s1), accuracy_queries(b/2, k, s2))
 
 
 def accuracy_baseline(b, k, s1, s2):
@@ -39,13 +56,13 @@ def accuracy_baseline(b, k, s1, s2):
 def beta1_baseline(b, k, s1, s2):
     def opt(b1):
         return b - b1 - k*(b1**(s1/s2))
-    return optimize(opt, b/2)
+    return optimize(opt, b, k, s1, s2)
 
 
 def beta2_baseline(b, k, s1, s2):
     def opt(b2):
         return b - b2 - (b2/k)**(s2/s1)
-    return optimize(opt, b/2)
+    return optimize(opt, b, k, s1, s2)
 
 
 def accuracy_improved(b, k, s1, s2):
@@ -56,43 +73,59 @@ def accuracy_improved(b, k, s1, s2):
 
 def beta1_improved(b, k, s1, s2):
     def opt(b1):
-        return b - b1 - 1 + (1 - b1**(s1/s2))**k
-    return optimize(opt, b/2)
+        return b - b1 + np.expm1(k*np.log1p(-b1**(s1/s2)))
+    return optimize(opt, b, k, s1, s2)
 
 
 def beta2_improved(b, k, s1, s2):
     def opt(b2):
-        return b - b2 - (1 - (1 - b2)**(1/k))**(s2/s1)
-    return optimize(opt, b/2)
+        return b - b2 - (-np.expm1(np.log1p(-b2)/k))**(s2/s1)
+    return optimize(opt, b, k, s1, s2)
 
 
 def accuracy_optimized(b, k, s1, s2):
-    return s1 * log((s2/s1 + 1)/b) + s2 * log(k*(s1/s2 + 1)/b)
-
-
-def optimize(func, guess):
-    return root(func, guess).x[0]
+    return s1 * np.log((s2/s1 + 1)/b) + s2 * np.log(k*(s1/s2 + 1)/b)
+
+
+def optimize(func, b, *params):
+    """
+    root of `func` in (0, b], broadcast over `b` and `params`.
+    all beta equations are decreasing with func(0) > 0 >= func(b),
+    so bisection is guaranteed to converge.
+    we bisect on log(beta), so tiny roots keep their relative precision.
+    roots below the smallest positive float come out as zero.
+    """
+    shape = np.broadcast(b, *params).shape
+    lower = np.full(shape, log(SMALLEST))
+    upper = lower - log(SMALLEST) + np.log(b)
+    for _ in range(BISECTIONS):
+        middle = (lower + upper) / 2
+        positive = func(np.exp(middle)) > 0
+        lower = np.where(positive, middle, lower)
+        upper = np.where(positive, upper, middle)
+    root = np.exp((lower + upper) / 2)
+    return np.where(func(SMALLEST) > 0, root, 0)[()]
 
 
 def threshold(a1, s1):
-    return exp(-a1/s1)
+    return np.exp(-a1/s1)
 
 
 def queries(a2, k, s2):
     """upper bound on probability that any of k queries is >= x"""
-    return clip(k*exp(-a2/s2))
+    return clip(k*np.exp(-a2/s2))
 
 
 def queries_improved(a2, k, s2):
     """precise probability that any of k queries is >= x"""
-    return clip(1 - (1 - exp(-a2/s2))**k)
+    return clip(1 - (1 - np.exp(-a2/s2))**k)
 
 
 def probability_overestimate(a, k, e1, e2):
     # we have to take factor two on the resulting probability since we assume b1 = b2 = b/2,
     # and each noise factor accounts for only one part of the probability budget
     # same goes for the argument `a`, where we assume a1 = a2 = a/2
-    return clip(2 * max(threshold(a/2, e1), queries(a/2, k, e2)))
+    return clip(2 * np.maximum(threshold(a/2, e1), queries(a/2, k, e2)))
 
 
 def probability_baseline(a, k, s1, s2):
@@ -110,21 +143,115 @@ def probability_improved(a, k, s1, s2):
 
 def probability_optimized(a, k, s1, s2):
     # inverse function of accuracy_optimized
-    return clip((((s2/s1 + 1)**(s1/(s1 + s2)) * (k*(s1/s2 + 1))**(s2/(s1 + s2))) / exp(a/(s1 + s2))))
+    return clip((((s2/s1 + 1)**(s1/(s1 + s2)) * (k*(s1/s2 + 1))**(s2/(s1 + s2))) / np.exp(a/(s1 + s2))))
 
 
 def probability_precise(x, k, s1, s2):
-    def inner(z):
-        def wrap(t):
-            return exp((t-z)/s1 - t/s2) * ((1-exp(-t/s2))**(k-1))
-        return wrap
-    def outer(z):
-        return (k/(s1*s2)) * quad(inner(z), 0, z)[0]
-    return 1 - quad(outer, 0, x)[0]
+    """precise probability that threshold noise plus the maximum of k query noises is >= x"""
+    # solving the inner integral by swapping the order of integration leaves
+    # 1 - Pr(M <= x) + integral_0^x exp((t-x)/s1) * f(t) dt,
+    # where M is the maximum of k query noises with density f.
+    # the integrand is only non-negligible within a few multiples of s1 below x
+    # and of s2 around the mode of f, so fixed Gauss-Legendre panels suffice.
+    x = np.maximum(x, 0)
+    lower = np.maximum(np.maximum(x - TAIL*s1, s2*log(max(k-1, 1)/TAIL)), 0)
+    upper = np.minimum(x, s2*(log(k) + TAIL))
+    lower = np.minimum(lower, upper)
+    width = upper - lower
+    panels = max(1, int(np.ceil(np.max(width) / (2*min(s1, s2)))))
+    half = width / (2*panels)
+    mids = lower[..., np.newaxis] + half[..., np.newaxis] * (2*np.arange(panels) + 1)
+    t = mids[..., np.newaxis] + half[..., np.newaxis, np.newaxis] * nodes
+    f = np.exp((t - x[..., np.newaxis, np.newaxis])/s1 + log(k/s2) - t/s2
+               + xlogy(k-1, -np.expm1(-t/s2)))
+    inside = half * np.sum(f * weights, axis=(-2, -1))
+    with np.errstate(divide='ignore'):
+        outside = -np.expm1(k*np.log1p(-np.exp(-x/s2)))
+    return np.minimum(outside + inside, 1)[()]
+
+
+def write_table(filename=TABLE):
+    """
+    tabulate `probability_precise` over log(s1/s2), log(k) and y = (x - s2*log(k))/(s1 + s2),
+    which are the only quantities it depends on,
+    and record an estimate of the interpolation error per cell
+    """
+    ratios = np.linspace(log(1e-3), log(1e3), 49)
+    ks = np.linspace(log(10), log(1e8), 29)
+    ys = np.unique(np.concatenate([np.linspace(-20, -5, 16), np.linspace(-5, 10, 301),
+                                   np.linspace(10, 60, 51)]))
+    values = np.log(np.maximum(tabulate(ratios, ks, ys), TINY))
+
+    # compare against exact values at several points inside every cell.
+    # in between the error is only estimated, so keep a safety margin.
+    interpolate = RegularGridInterpolator((ratios, ks, ys), values)
+    error = np.zeros((len(ratios) - 1, len(ks) - 1))
+    inner = np.concatenate([ys[:-1] + f*np.diff(ys) for f in PROBES])
+    for a in PROBES:
+        for b in PROBES:
+            probes = [ratios[:-1] + a*np.diff(ratios), ks[:-1] + b*np.diff(ks), inner]
+            exact = tabulate(*probes)
+            points = np.stack(np.meshgrid(*probes, indexing='ij'), axis=-1)
+            deviation = np.max(np.abs(np.exp(interpolate(points)) - exact), axis=-1)
+            error = np.maximum(error, deviation)
+    error *= SAFETY
+
+    np.savez_compressed(filename, ratios=ratios, ks=ks, ys=ys,
+                        values=values.astype(np.float32), error=error)
+
+
+def tabulate(ratios, ks, ys):
+    values = np.empty((len(ratios), len(ks), len(ys)))
+    for i, r in enumerate(np.exp(ratios)):
+        # only the ratio matters, so fix s1 + s2 = 1
+        s1, s2 = r/(1 + r), 1/(1 + r)
+        for j, k in enumerate(np.exp(ks)):
+            values[i, j] = probability_precise(ys + s2*log(k), k, s1, s2)
+    return values
+
+
+def load_table(filename=TABLE):
+    """load the lookup table once per process, or None if it was never written"""
+    global table
+    if table is None and os.path.exists(filename):
+        with np.load(filename) as f:
+            grid = (f['ratios'], f['ks'], f['ys'])
+            interpolate = RegularGridInterpolator(grid, f['values'].astype(float))
+            table = (grid, interpolate, f['error'])
+    return table
+
+
+def probability_table(x, k, s1, s2, error=1e-2):
+    """
+    `probability_precise` from the lookup table where it is accurate to `error`,
+    with exact evaluation everywhere else
+    """
+    x = np.asarray(x, dtype=float)
+    t = load_table()
+    if t is None:
+        return probability_precise(x, k, s1, s2)
+    (ratios, ks, ys), interpolate, errors = t
+    r = log(s1/s2)
+    lk = log(k)
+    if not (ratios[0] <= r <= ratios[-1] and ks[0] <= lk <= ks[-1]):
+        return probability_precise(x, k, s1, s2)
+    i = min(np.searchsorted(ratios, r, side='right'), len(ratios) - 1) - 1
+    j = min(np.searchsorted(ks, lk, side='right'), len(ks) - 1) - 1
+    if errors[i, j] > error:
+        return probability_precise(x, k, s1, s2)
+
+    y = (x - s2*lk)/(s1 + s2)
+    inside = (ys[0] <= y) & (y <= ys[-1])
+    result = np.empty(x.shape)
+    points = np.stack(np.broadcast_arrays(r, lk, y[inside]), axis=-1)
+    result[inside] = np.exp(interpolate(points))
+    if not inside.all():
+        result[~inside] = probability_precise(x[~inside], k, s1, s2)
+    return result[()]
 
 
 def clip(x):
-    return min(1, x)
+    return np.minimum(1, x)
 
 
 def plot():
@@ -144,11 +271,11 @@ def plot():
 
     xs = np.arange(MAX)
 
-    ax.plot(xs, [probability_overestimate(x, k, s1, s2) for x in xs], color="pink", linewidth=2.0, label="overestimate")
-    ax.plot(xs, [probability_baseline(x, k, s1, s2) for x in xs], color="red", linewidth=2.0, label="baseline")
-    ax.plot(xs, [probability_improved(x, k, s1, s2) for x in xs], color="green", linewidth=2.0, label="improved")
-    ax.plot(xs, [probability_optimized(x, k, s1, s2) for x in xs], color="blue", linewidth=2.0, label="optimized")
-    ax.plot(xs, [probability_precise(x, k, s1, s2) for x in xs], color="black", linewidth=2.0, label="precise")
+    ax.plot(xs, probability_overestimate(xs, k, s1, s2), color="pink", linewidth=2.0, label="overestimate")
+    ax.plot(xs, probability_baseline(xs, k, s1, s2), color="red", linewidth=2.0, label="baseline")
+    ax.plot(xs, probability_improved(xs, k, s1, s2), color="green", linewidth=2.0, label="improved")
+    ax.plot(xs, probability_optimized(xs, k, s1, s2), color="blue", linewidth=2.0, label="optimized")
+    ax.plot(xs, probability_table(xs, k, s1, s2), color="black", linewidth=2.0, label="precise")
     ax.legend(loc='lower left')
     ax.set_xlabel(r"$\alpha$")
     ax.set_ylabel(r"$\beta$")
@@ -158,10 +285,10 @@ def plot():
     plt.ylim(0,1)
     plt.xlim(0,MAX)
     ys = np.linspace(0.001,1,256)
-    ax.plot([accuracy_overestimate(y, k, s1, s2) for y in ys], ys, color="pink", linewidth=2.0, label="overestimate")
-    ax.plot([accuracy_baseline(y, k, s1, s2) for y in ys], ys, color="red", linewidth=2.0, label="baseline")
-    ax.plot([accuracy_improved(y, k, s1, s2) for y in ys], ys, color="green", linewidth=2.0, label="improved")
-    ax.plot([accuracy_optimized(y, k, s1, s2) for y in ys], ys, color="blue", linewidth=2.0, label="optimized")
+    ax.plot(accuracy_overestimate(ys, k, s1, s2), ys, color="pink", linewidth=2.0, label="overestimate")
+    ax.plot(accuracy_baseline(ys, k, s1, s2), ys, color="red", linewidth=2.0, label="baseline")
+    ax.plot(accuracy_improved(ys, k, s1, s2), ys, color="green", linewidth=2.0, label="improved")
+    ax.plot(accuracy_optimized(ys, k, s1, s2), ys, color="blue", linewidth=2.0, label="optimized")
     ax.legend(loc='lower left')
     ax.set_xlabel(r"$\alpha$")
     ax.set_ylabel(r"$\beta$")
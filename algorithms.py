@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 
-from math import copysign
-from math import exp
-from math import floor
-from scipy.stats import laplace
-from scipy.stats import norm
+from math import log
+from math import pi
+from math import sqrt
+import numpy as np
+from scipy.special import log_ndtr
+from scipy.special import logsumexp
+from scipy.special import ndtr
+
+from histogram import Histogram
+from histogram import take
 
 
 def epsilon(e, ratio=1):
@@ -24,11 +29,12 @@ def scale(e1, e2, c=1, sensitivity=1, monotonic=True):
     return s1, s2
 
 
-def report_noisy_max(database, queries, epsilon):
-    return [Laplace(1/epsilon, database[q]) for q in queries]
+def report_noisy_max(database, queries, e):
+    locs = take(database, queries)
+    return LaplaceArray(np.broadcast_to(1/e, locs.shape), locs)
 
 
-def sparse(database, queries, threshold, epsilon, ratio,
+def sparse(database, queries, threshold, e, ratio,
            c=1, sensitivity=1, monotonic=True):
     """
     since this is an abstraction to random distributions, and we have no
@@ -36,24 +42,26 @@ def sparse(database, queries, threshold, epsilon, ratio,
     the caller's obligation to sample from the distributions and cut off
     the result when `c` positive answers are collected.
     """
-    e1, e2 = epsilon(epsilon, ratio)
+    e1, e2 = epsilon(e, ratio)
     s1, s2 = scale(e1, e2, c, sensitivity, monotonic)
     T = Laplace(s1, threshold)
-    return T, [Laplace(s2, database[q]) for q in queries]
+    locs = take(database, queries)
+    # all queries share one scale, so don't store it per query
+    return T, LaplaceArray(np.broadcast_to(s2, locs.shape), locs)
 
 
-def exponential(database, utility, epsilon, sensitivity=1, monotonic=True):
+def exponential(database, utility, e, sensitivity=1, monotonic=True):
+    """
+    distribution over the indices of `database`.
+    `utility` is applied to the array of database values at once,
+    or only to the distinct counts if `database` is a `Histogram`.
+    """
     m = factor(monotonic)
-
-    def weight(x):
-        return exp((epsilon*utility(database[x]))/(m*sensitivity))
-
-    normalization = sum(weight(x) for x in database)
-
-    def distribution(x):
-        return weight(x) / normalization
-
-    return disribution
+    if isinstance(database, Histogram):
+        scores = np.asarray(utility(database.descending), dtype=float)
+        return GroupedExponential(e*scores/(m*sensitivity), database.cumulative)
+    scores = np.asarray(utility(np.asarray(database)), dtype=float)
+    return Exponential(e*scores/(m*sensitivity))
 
 
 class Distribution(object):
@@ -67,15 +75,123 @@ class Distribution(object):
     def larger(self, other):
         return 1 - self.differenceCDF(other)(0)
 
+    def shape(self, size=None):
+        """shape of `size` samples from the distribution"""
+        shape = np.broadcast(self.scale, self.loc).shape
+        if size is None:
+            return shape or None
+        return tuple(np.atleast_1d(size)) + shape
+
+
+class Exponential(object):
+    """
+    discrete distribution with probabilities proportional to `exp(scores)`.
+    weights are normalized in log space, so large scores do not overflow.
+    """
+
+    def __init__(self, scores):
+        self.log_probabilities = scores - logsumexp(scores)
+        self.probabilities = np.exp(self.log_probabilities)
+        cumulative = np.cumsum(self.probabilities)
+        self.cumulative = cumulative / cumulative[-1]
+
+    def __len__(self):
+        return len(self.probabilities)
+
+    def __call__(self, x):
+        return self.pdf(x)
+
+    def pdf(self, x):
+        return self.probabilities[x]
+
+    def cdf(self, x):
+        return self.cumulative[x]
+
+    def sample(self, size=None):
+        """draw indices by binary search on the cumulative distribution"""
+        u = np.random.random_sample(size)
+        return np.searchsorted(self.cumulative, u, side='right')
+
+
+class GroupedExponential(Exponential):
+    """
+    `Exponential` over consecutive groups of indices with equal scores,
+    where group `i` covers the indices from `bounds[i]` up to `bounds[i+1]`.
+    a group is drawn by its total weight, and then an index within it uniformly.
+    """
+
+    def __init__(self, scores, bounds):
+        self.bounds = np.asarray(bounds)
+        self.sizes = np.diff(self.bounds)
+        super().__init__(scores + np.log(self.sizes))
+
+    def __len__(self):
+        return int(self.bounds[-1])
+
+    def group(self, x):
+        return np.searchsorted(self.bounds, x, side='right') - 1
+
+    def pdf(self, x):
+        return (self.probabilities / self.sizes)[self.group(x)]
+
+    def cdf(self, x):
+        group = self.group(x)
+        before = self.cumulative[group] - self.probabilities[group]
+        return before + self.pdf(x) * (x - self.bounds[group] + 1)
+
+    def sample(self, size=None):
+        group = super().sample(size)
+        offset = np.floor(np.random.random_sample(size) * self.sizes[group]).astype(int)
+        return self.bounds[group] + offset
+
+
+class DistributionArray(object):
+    """
+    collection of distributions of the same kind, with parameters stored as arrays.
+    all methods evaluate every member at once, broadcasting arguments against
+    the last axis. slicing returns a view on the parameters.
+    """
+    kind = None
+
+    def __init__(self, scale, loc=0):
+        scale, loc = np.broadcast_arrays(scale, loc)
+        super().__init__(scale, loc)
+
+    def __len__(self):
+        return len(self.loc)
+
+    def __getitem__(self, key):
+        scale = self.scale[key]
+        loc = self.loc[key]
+        if np.ndim(loc) == 0:
+            return self.kind(scale.item(), loc.item())
+        return type(self)(scale, loc)
+
 
 class Laplace(Distribution):
     """Laplace distribution"""
 
     def pdf(self, x):
-        return laplace.pdf(x, scale=self.scale, loc=self.loc)
+        z = np.abs(x - self.loc) / self.scale
+        return np.exp(-z) / (2*self.scale)
 
     def cdf(self, x):
-        return laplace.cdf(x, scale=self.scale, loc=self.loc)
+        z = (x - self.loc) / self.scale
+        # only ever exponentiate the negative half to avoid overflow
+        h = np.exp(-np.abs(z)) / 2
+        return np.where(z < 0, h, 1 - h)[()]
+
+    def logpdf(self, x):
+        return -np.abs(x - self.loc) / self.scale - np.log(2*self.scale)
+
+    def logcdf(self, x):
+        return laplace_logcdf((x - self.loc) / self.scale)
+
+    def logsf(self, x):
+        return laplace_logcdf((self.loc - x) / self.scale)
+
+    def sample(self, size=None):
+        return np.random.laplace(self.loc, self.scale, self.shape(size))
 
     def difference(self, other):
         """difference of two Laplace distributions"""
@@ -85,13 +201,12 @@ class Laplace(Distribution):
         n = other.loc
 
         def diff(x):
-            t = abs(x+n-m)
-            k = exp(-t/a)
-            l = exp(-t/b)
-            if a == b:
-                return (k + (t/a)*k) / (4*a)
-            else:
-                return ((k+l)/(a+b) + (k-l)/(a-b)) / 4
+            t = np.abs(x+n-m)
+            k = np.exp(-t/a)
+            l = np.exp(-t/b)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                unequal = ((k+l)/(a+b) + (k-l)/(a-b)) / 4
+            return np.where(a == b, (k + (t/a)*k) / (4*a), unequal)[()]
 
         return diff
 
@@ -102,14 +217,13 @@ class Laplace(Distribution):
         n = other.loc
 
         def diffCDF(x):
-            t = abs(x+n-m)
+            t = np.abs(x+n-m)
             s = sgn(x+n-m)
-            k = exp(-t/a)
-            l = exp(-t/b)
-            if a == b:
-                return (-s * (2*a+t)*k / (2*a) + 1 + s)/2
-            else:
-                return (-s * ((a*k + b*l)/(a+b) + (a*k - b*l)/(a-b)) / 2 + 1 + s)/2
+            k = np.exp(-t/a)
+            l = np.exp(-t/b)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                unequal = (-s * ((a*k + b*l)/(a+b) + (a*k - b*l)/(a-b)) / 2 + 1 + s)/2
+            return np.where(a == b, (-s * (2*a+t)*k / (2*a) + 1 + s)/2, unequal)[()]
 
         return diffCDF
 
@@ -118,27 +232,49 @@ class Gaussian(Distribution):
     """Gaussian distribution"""
 
     def pdf(self, x):
-        return norm.pdf(x, scale=self.scale, loc=self.loc)
+        z = (x - self.loc) / self.scale
+        return np.exp(-z**2/2) / (self.scale * sqrt(2*pi))
 
     def cdf(self, x):
-        return norm.cdf(x, scale=self.scale, loc=self.loc)
+        z = (x - self.loc) / self.scale
+        return ndtr(z)
 
-    def difference(self, other):
-        def diff(x):
-            b = self.scale**2 + other.scale**2
-            m = self.loc - other.loc
-            return norm.pdf(x, scale=b, loc=m)
+    def logpdf(self, x):
+        z = (x - self.loc) / self.scale
+        return -z**2/2 - np.log(self.scale * sqrt(2*pi))
 
-        return diff
+    def logcdf(self, x):
+        return log_ndtr((x - self.loc) / self.scale)
+
+    def logsf(self, x):
+        return log_ndtr((self.loc - x) / self.scale)
+
+    def sample(self, size=None):
+        return np.random.normal(self.loc, self.scale, self.shape(size))
+
+    def difference(self, other):
+        """difference of two Gaussian distributions"""
+        return Gaussian(np.hypot(self.scale, other.scale), self.loc - other.loc).pdf
 
     def differenceCDF(self, other):
-        def diffCDF(x):
-            b = self.scale**2 + other.scale**2
-            m = self.loc - other.loc
-            return norm.cdf(x, scale=b, loc=m)
+        return Gaussian(np.hypot(self.scale, other.scale), self.loc - other.loc).cdf
 
-        return diffCDF
+
+class LaplaceArray(DistributionArray, Laplace):
+    """collection of Laplace distributions"""
+    kind = Laplace
+
+
+class GaussianArray(DistributionArray, Gaussian):
+    """collection of Gaussian distributions"""
+    kind = Gaussian
+
+
+def laplace_logcdf(z):
+    """log of the standard Laplace cdf, accurate in both tails"""
+    h = -np.abs(z) - log(2)
+    return np.where(z < 0, h, np.log1p(-np.exp(h)))[()]
 
 
 def sgn(x):
-    return copysign(1, x)
+    return np.copysign(1, x)
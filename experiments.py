@@ -1,13 +1,14 @@
 #!/usr/bin/env python3
 
-from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
 import json
 import matplotlib.pyplot as plt
 from math import log
 from math import isclose
 import numpy as np
-from numpy import product
-from scipy.integrate import quad
+import os
+from scipy.linalg import block_diag
 from scipy.stats import rv_discrete
 
 from accuracy import probability_precise
@@ -17,7 +18,12 @@ from algorithms import scale
 from algorithms import epsilon
 from algorithms import factor
 from algorithms import Laplace
-from naive import sparse
+from histogram import Histogram
+from naive import Permutations
+from naive import sparse_batch
+from naive import streams
+from results import Results
+from results import Writer
 
 
 datasets = {
@@ -32,6 +38,8 @@ e = 0.1  # this is what [@svt] used
 cs = list(range(25, 301, 25))
 b_min = 0.01  # only compute probabilities down to this value
 N = 100
+# error probabilities this close to one are indistinguishable from one by integration
+SATURATED = 1e-12
 
 
 def threshold(c, queries):
@@ -52,19 +60,33 @@ colors = ['black', 'magenta', 'blue', 'red']
 
 
 def read_data(data):
-    with open('data/{}.json'.format(data)) as f:
-        items = json.load(f, object_hook=convert)
-        counts = Counter(items.values())
-    array = np.loadtxt('data/{}.txt'.format(data), dtype=int)
-    return counts, array
-
-
-def above(queries, T, a):
-    return {k: v for k, v in queries.items() if k >= T + a}
-
-
-def below(queries, T, a):
-    return {k: v for k, v in queries.items() if k <= T - a}
+    """
+    histogram of the item counts, and all item counts in descending order.
+    the text files in `data/` are converted to binary once,
+    then memory-mapped and cached per process.
+    """
+    if data not in data_cache:
+        filename = 'data/{}-histogram.npy'.format(data)
+        if not os.path.exists(filename):
+            convert_data(data)
+        array = np.load('data/{}.npy'.format(data), mmap_mode='r')
+        counts, multiplicities = np.load(filename, mmap_mode='r')
+        data_cache[data] = Histogram(counts, multiplicities), array
+    return data_cache[data]
+
+
+data_cache = {}
+
+
+def convert_data(data):
+    array = np.sort(np.loadtxt('data/{}.txt'.format(data), dtype=int))[::-1]
+    groups = np.stack(np.unique(array, return_counts=True))
+    # the histogram is written last, so it marks a complete conversion
+    for name, x in (('data/{}.npy', array), ('data/{}-histogram.npy', groups)):
+        filename = name.format(data)
+        with open(filename + '.tmp', 'wb') as f:
+            np.save(f, x)
+        os.replace(filename + '.tmp', filename)
 
 
 def write_alphas(data, start=None, end=None):
@@ -72,6 +94,9 @@ def write_alphas(data, start=None, end=None):
     # above and below the T+/-alpha range
     query_counts, query_array = read_data(data)
     k = query_array[0]
+    # sort the count groups once for all `c`, and store them only once
+    groups = count_groups(query_counts)
+    np.save('experiments/{}-groups.npy'.format(data), np.stack(groups))
 
     print("loaded {}, max. value: {}".format(data, k))
 
@@ -79,141 +104,395 @@ def write_alphas(data, start=None, end=None):
         T = threshold(c, query_array)
         print('T:', T, end=' ')
 
-        result = compute_alphas(c, T, k, query_counts)
+        result = compute_alphas(c, T, k, groups)
+
+        # per alpha we only need the boundary indices into the groups
+        boundaries = np.stack([result.alphas, result.below, result.above])
+        np.save('experiments/{}-alphas {}.npy'.format(data, c), boundaries)
 
-        with open('experiments/{}-alphas {}.txt'.format(data, c), 'w') as f:
-            json.dump(result, f, separators=(',', ':'))
+
+def count_groups(query_counts):
+    """
+    distinct counts in ascending order and their multiplicities,
+    from a mapping, a `Histogram` or an already sorted pair of arrays
+    """
+    if isinstance(query_counts, Histogram):
+        return query_counts.counts, query_counts.multiplicities
+    if isinstance(query_counts, tuple):
+        return query_counts
+    counts = np.array(list(query_counts.keys()))
+    multiplicities = np.array(list(query_counts.values()))
+    order = np.argsort(counts, kind='stable')
+    return counts[order], multiplicities[order]
 
 
 def compute_alphas(c, T, k, query_counts):
-    # collect unique sets of queries outside  the T+/-alpha range
-    # this implicitly takes the largest `a` for each set
-    above_below = {}
-    for a in range(int(T)):
-        queries_below = below(query_counts, T, a)
-        queries_above = above(query_counts, T, a)
-        key = (len(queries_below.keys()), len(queries_above.keys()))
-        above_below[key] = {
-            'alpha': a,
-            'below': queries_below,
-            'above': queries_above,
+    # collect unique sets of queries outside  the T+/-alpha range,
+    # taking the largest integer `a` in [0, T) for each set.
+    # the sets only change right after `a` passes the distance of some count to T,
+    # so those distances are the only candidates.
+    counts, multiplicities = count_groups(query_counts)
+    last = int(T) - 1
+    ends = np.concatenate([np.floor(T - counts[counts <= T]),
+                           np.floor(counts[counts >= T] - T), [last]])
+    alphas = np.unique(ends[(ends >= 0) & (ends <= last)]).astype(int)
+    below = np.searchsorted(counts, T - alphas, side='right')
+    above = np.searchsorted(counts, T + alphas, side='left')
+    print('c:', c, len(alphas), end='\r')
+
+    return Alphas(counts, multiplicities, alphas, below, above)
+
+
+class Alphas(object):
+    """
+    count groups below T - alpha and above T + alpha for every alpha,
+    stored as one sorted array of groups and boundary indices into it.
+    behaves like the mapping `{alpha: {'below': {...}, 'above': {...}}}`.
+    """
+
+    def __init__(self, counts, multiplicities, alphas, below, above):
+        self.counts = counts
+        self.multiplicities = multiplicities
+        self.alphas = alphas
+        """number of groups at or below T - alpha"""
+        self.below = below
+        """index of the first group at or above T + alpha"""
+        self.above = above
+
+    def __len__(self):
+        return len(self.alphas)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return self.alphas.tolist()
+
+    def __getitem__(self, a):
+        i = self.index(a)
+        return {
+            'below': self.groups(0, self.below[i]),
+            'above': self.groups(self.above[i], len(self.counts)),
         }
-    print('c:', c, len(above_below), end='\r')
 
-    result = {}
-    for _, v in above_below.items():
-        result[v['alpha']] = {
-            'below': v['below'],
-            'above': v['above'],
-        }
+    def index(self, a):
+        """position of one or more alphas"""
+        i = np.searchsorted(self.alphas, a)
+        found = self.alphas[np.minimum(i, len(self.alphas) - 1)] == a
+        if not np.all(found & (i < len(self.alphas))):
+            raise KeyError(a)
+        return i
+
+    def groups(self, start, end):
+        return dict(zip(self.counts[start:end].tolist(), self.multiplicities[start:end].tolist()))
+
+    def to_dict(self):
+        return {a: self[a] for a in self.keys()}
 
-    return result
 
 def read_alphas(data, c):
-    with open('experiments/{}-alphas {}.txt'.format(data, c)) as f:
-        return json.load(f, object_hook=convert)
+    counts, multiplicities = np.load('experiments/{}-groups.npy'.format(data), mmap_mode='r')
+    alphas, below, above = np.load('experiments/{}-alphas {}.npy'.format(data, c), mmap_mode='r')
+    return Alphas(counts, multiplicities, alphas, below, above)
+
+
+def basic(a, k, s1, s2, *args):
+    # one curve per pair of scales
+    pairs = np.broadcast(s1, s2)
+    curves = [probability_precise(a, k, x, y) for x, y in pairs]
+    return np.reshape(curves, pairs.shape + np.shape(a))
+
+
+def precise(a, k, s1, s2, queries, alphas, T, full_output=False, tolerance=1e-15):
+    """
+    probability of an error larger than `a`, given the data.
+    `a` may also be an array of alphas, and `s1`, `s2` arrays of scales,
+    which are then all evaluated in one sweep, giving one curve per pair of scales.
+    groups far from the threshold are left out, as long as that changes the result
+    by at most `tolerance`. with `full_output`, also return an estimate of the
+    absolute integration error including that bound, and the number of groups left out.
+    """
+    i = alphas.index(a)
+    flat = np.ravel(i)
+    counts = alphas.counts
+    multiplicities = alphas.multiplicities
+    pairs = np.broadcast(s1, s2)
+
+    # integrate over some sufficiently large quantile of the threshold distribution,
+    # here we take everything except a 2*error part.
+    # bounds of [0, max(queries)] as I had them before will give catastrophically wrong results.
+    error = 1/1e12
+    # the integrand has kinks at the threshold and at the location of
+    # each group that is outside T +/- a for any of the alphas.
+    kinks = np.concatenate([counts[:np.max(alphas.below[flat])],
+                            counts[np.min(alphas.above[flat]):]])
+    # one grid per pair of scales, all evaluated together,
+    # with the weights of each grid in one row of `high` and `low`.
+    xs, high, low, scales, windows = [], [], [], [], []
+    for x, y in pairs:
+        T_bound = x * log(1/error)
+        lower, upper = T - T_bound, T + T_bound
+        windows.append((lower, upper, y))
+        inside = kinks[(lower < kinks) & (kinks < upper)]
+        breaks = np.unique(np.concatenate([[lower, T, upper], inside]))
+        nodes, h, l = quadrature(breaks, min(x, y))
+        xs.append(nodes)
+        high.append(h)
+        low.append(l)
+        scales.append(np.broadcast_to([[x], [y]], (2, len(nodes))))
+    xs = np.concatenate(xs)
+    high = block_diag(*high)
+    low = block_diag(*low)
+    s1, s2 = np.concatenate(scales, axis=1)
+    density = Laplace(s1, T).pdf(xs)
+    first, last, bound = negligible(counts, multiplicities, T, *np.transpose(windows), tolerance)
+
+    # the error probabilities of single queries are usually so small that
+    # the probability of a correct response rounds to exactly one.
+    # so we sum log-probabilities of correct responses, which stay representable,
+    # and get the error probability from them with `expm1`.
+    # going from the largest alpha down, groups only ever join the sum,
+    # so every group is evaluated once per sweep and nothing cancels.
+    log_correct = np.zeros(len(xs))
+    below, above = first, last
+    p = np.empty((len(high), len(flat)))
+    err = np.empty((len(high), len(flat)))
+    for j in np.argsort(flat)[::-1]:
+        n = flat[j]
+        group = slice(below, max(below, alphas.below[n]))
+        log_correct += log_queries(s2, counts[group], multiplicities[group], False, xs)
+        group = slice(min(above, alphas.above[n]), above)
+        log_correct += log_queries(s2, counts[group], multiplicities[group], True, xs)
+        below, above = max(below, alphas.below[n]), min(above, alphas.above[n])
+
+        state = density * -np.expm1(log_correct)
+        # the integrand is bounded by the threshold density, which has mass `error` outside.
+        # we count all of it as error probability, so saturated curves reach exactly one.
+        p[:, j] = np.minimum(high @ state + error, 1)
+        err[:, j] = np.abs(high @ state - low @ state) + error + bound
+
+    shape = pairs.shape + np.shape(i)
+    if full_output:
+        return p.reshape(shape)[()], err.reshape(shape)[()], first + len(counts) - last
+    return p.reshape(shape)[()]
+
+
+def negligible(counts, multiplicities, T, lowers, uppers, s2, tolerance):
+    """
+    number of groups at the low end, and index of the first group at the high end,
+    such that the groups beyond change the error probability by at most `tolerance`
+    on any of the integration windows given by `lowers`, `uppers` and `s2`.
+    also returns the bound on that change.
+    """
+    counts = np.asarray(counts, dtype=float)
+    with np.errstate(divide='ignore'):
+        log_n = np.log(multiplicities)
+    # a group at distance d from the closest window edge contributes
+    # n*log(1 - exp(-d/s2)/2) >= -n*exp(-d/s2) to the sum of log-probabilities,
+    # and the error probability changes by at most the change in that sum.
+    # groups inside some window have negative distance and are never left out.
+    distance = np.where(counts < T, lowers[:, np.newaxis] - counts, counts - uppers[:, np.newaxis])
+    log_bound = log_n - np.min(distance / s2[:, np.newaxis], axis=0)
+    log_bound[(distance < 0).any(axis=0)] = np.inf
+
+    low = np.logaddexp.accumulate(log_bound[counts < T])
+    high = np.logaddexp.accumulate(log_bound[counts >= T][::-1])
+    # without any tolerance only groups that cannot contribute at all are left out
+    cutoff = log(tolerance/2) if tolerance > 0 else -np.inf
+    first = np.searchsorted(low, cutoff, side='right')
+    last = len(counts) - np.searchsorted(high, cutoff, side='right')
+    bound = sum(np.exp(x[n-1]) for x, n in ((low, first), (high, len(counts) - last)) if n)
+    return first, last, bound
+
+
+# Gauss-Legendre rules for `quadrature`, the lower order only serves as an error estimate
+nodes, weights = np.polynomial.legendre.leggauss(10)
+nodes_low, weights_low = np.polynomial.legendre.leggauss(5)
+
+
+def quadrature(breaks, width):
+    """
+    nodes and weights for integrating between the first and last of the sorted `breaks`,
+    split at every break and into panels no wider than `width`.
+    the nodes of both rules are returned together, each weight vector is zero on the other's.
+    """
+    lengths = np.diff(breaks)
+    counts = np.maximum(1, np.ceil(lengths / width)).astype(int)
+    interval = np.repeat(np.arange(len(lengths)), counts)
+    # index of each panel within its interval
+    panel = np.arange(len(interval)) - np.repeat(np.cumsum(counts) - counts, counts)
+    half = (lengths[interval] / counts[interval] / 2)[:, np.newaxis]
+    mids = breaks[interval][:, np.newaxis] + half * (2*panel + 1)[:, np.newaxis]
+
+    xs = np.concatenate([(mids + half * nodes).ravel(), (mids + half * nodes_low).ravel()])
+    high = np.zeros(len(xs))
+    low = np.zeros(len(xs))
+    size = len(mids) * len(nodes)
+    high[:size] = (half * weights).ravel()
+    low[size:] = (half * weights_low).ravel()
+    return xs, high, low
+
+
+def log_queries(scale, locs, multiplicities, is_above, threshold, block=256):
+    """
+    sum of log Pr(query(scale, loc) => is_above | threshold_value ) over all `locs`,
+    for every threshold value. groups are processed in blocks to bound memory.
+    """
+    result = np.zeros(np.shape(threshold))
+    for start in range(0, len(locs), block):
+        loc = np.asarray(locs[start:start+block])[:, np.newaxis]
+        n = np.asarray(multiplicities[start:start+block])[:, np.newaxis]
+        result += np.sum(n * log_query_above(scale, loc, is_above, threshold), axis=0)
+    return result
 
 
-def convert(d):
+def log_query_above(scale, loc, is_above, threshold):
+    """log Pr(query(scale, loc) => is_above | threshold_value )"""
+    query = Laplace(scale, loc)
+    return np.where(is_above, query.logsf(threshold), query.logcdf(threshold))
+
+
+def write_probability(data, func, start=None, end=None, workers=None):
+    """
+    compute the error probabilities of `func` for every `c` and ratio.
+    each `c` is a task for a pool of `workers` processes (default: one per core).
+    finished values of `c` are recorded in a checkpoint, and curves that were
+    only partially written are continued after their last alpha,
+    so an interrupted run resumes exactly where it stopped.
+    """
+    workers = workers or os.cpu_count()
+    results = Results(data, func.__name__)
+    checkpoint = 'experiments/{}-{}-done.json'.format(data, func.__name__)
+    done = []
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            done = json.load(f)
+
+    tasks = [c for c in cs[start:end] if c not in done]
+    written = {c: {s: max(results.select(c, s)[0], default=-1) for s in ratios(c)} for c in tasks}
+    read_data(data)  # convert the data before workers start reading it
+    pool = ProcessPoolExecutor(workers, initializer=load_worker_database, initargs=(data,))
+    with pool, Writer(results) as writer:
+        futures = {pool.submit(probability_worker, data, func, c, written[c]): c for c in tasks}
+        for future in as_completed(futures):
+            c = futures[future]
+            for s, (alphas, ps) in future.result().items():
+                writer.append(c, s, alphas, ps)
+            done.append(c)
+            # only record `c` as done once its rows are on disk
+            writer.then(write_checkpoint(checkpoint, list(done)))
+            print("c: {} done".format(c))
+
+
+def write_checkpoint(filename, done):
+    def write():
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(done, f)
+        os.replace(filename + '.tmp', filename)
+    return write
+
+
+def probability_worker(data, func, c, written):
+    """alphas and probabilities still missing from the curves of all ratios for `c`"""
+    k = worker_database[0]
+    T = threshold(c, worker_database)
+    alphas = read_alphas(data, c)
+
+    # evaluate all alphas and ratios at once, so `precise` can share its integrand.
+    # even when resuming we compute every alpha, which costs about the same,
+    # so the curves come out exactly as in an uninterrupted run.
+    names = list(ratios(c).keys())
+    s1, s2 = scale(*epsilon(e, np.array(list(ratios(c).values()))), c)
+    curves = func(alphas.alphas, k, s1, s2, worker_database, alphas, T)
+
     result = {}
-    for k, v in d.items():
-        if k.isdigit():
-            result[int(k)] = v
-        else:
-            result[k] = v
+    for s, ps in zip(names, curves):
+        missing = ([], [])
+        last = 1
+        for a, p in zip(alphas.keys(), ps.tolist()):
+            # catch problems with integration.
+            # saturated curves may round to just below one and stay there.
+            saturated = p >= 1 - SATURATED
+            if (p >= last and not saturated) or p <= 0:
+                break
+            else:
+                last = p
+            if a > written[s]:
+                missing[0].append(a)
+                missing[1].append(p)
+        result[s] = missing
     return result
 
 
-def basic(a, k, s1, s2, *args):
-    return probability_precise(a, k, s1, s2)
+def write_samples(data, seed=None, workers=None):
+    """
+    recreate the experiments from [@svt].
+    trials are split among a pool of `workers` processes (default: one per core),
+    each with its own random stream derived from `seed`,
+    so results are reproducible for given `seed` and `workers`.
+    """
+    workers = workers or os.cpu_count()
+    trials = [len(x) for x in np.array_split(np.arange(N), workers)]
+    read_data(data)  # convert the data before workers start reading it
+    pool = ProcessPoolExecutor(workers, initializer=load_worker_database, initargs=(data,))
+    with pool:
+        results = list(pool.map(sample_worker, trials, streams(seed, workers)))
+
+    with Writer(Results(data, 'samples')) as writer:
+        for c in cs:
+            for s in ratios(c).keys():
+                # samples have no alpha
+                writer.append(c, s, -1, [x for result in results for x in result[c, s]])
 
 
-def precise(a, k, s1, s2, queries, alphas, T):
-    below = alphas[a]['below']
-    above = alphas[a]['above']
+def convert_results(data, name):
+    """move results of `name` from the text files of earlier versions to the result store"""
+    results = Results(data, name)
+    for c in cs:
+        for s in ratios(c).keys():
+            filename = 'experiments/{}-{} {} {}.txt'.format(data, name, c, s)
+            if not os.path.exists(filename):
+                continue
+            if name == 'samples':
+                results.append(c, s, -1, np.loadtxt(filename, ndmin=1))
+            else:
+                alphas, ps = np.loadtxt(filename, ndmin=2).T
+                results.append(c, s, alphas, ps)
 
-    # IMPORTANT: we *must* compute the probability of a correct response here,
-    # although eventually we want to have the error probability.
-    # the reason is that queries are usually so far away from the threshold that
-    # getting a wrong response is incredibly improbable, which in effect produces
-    # zeroes instead of *very very* small numbers. and by small I mean so small
-    # that even using gmpy2 with precision 10000 doesn't capture them properly.
-    rs = [False] * len(below) + [True] * len(above)
-    qs = {**below, **above}
 
-    def pred(x):
-        return product([query_above(s2, q, r, x)**n for (r, (q, n)) in zip(rs, qs.items())])
+# each worker process maps the database only once
+worker_database = None
 
-    def state(x):
-        return Laplace(s1, T).pdf(x) * pred(x)
 
-    # integrate over some sufficiently large quantile of the threshold distribution,
-    # here we take everything except a 2*error part.
-    # bounds of [0, max(queries)] as I had them before will give catastrophically wrong results.
-    error = 1/1e12
-    T_bound = s1 * log(1/error)
-    return 1 - quad(state, T-T_bound, T+T_bound, points=[T])[0]
+def load_worker_database(data):
+    global worker_database
+    _, worker_database = read_data(data)
 
 
-def query_above(scale, loc, is_above, threshold):
-    """Pr(query(scale, loc) => is_above | threshold_value )"""
-    pr_above = 1 - Laplace(scale, loc).cdf(threshold)
-    if is_above:
-        return pr_above
-    else:
-        return 1 - pr_above
+def sample_worker(trials, rng):
+    return sample_trials(worker_database, trials, rng)
 
 
-def write_probability(data, func, start=None, end=None):
-    query_counts, query_array = read_data(data)
-    k = query_array[0]
-    for c in cs[start:end]:
-        T = threshold(c, query_array)
-        alphas = read_alphas(data, c)
-        total = len(alphas)
+def sample_trials(database, trials, rng):
+    """score error rates of `trials` runs of `sparse` for every `c` and ratio"""
+    # every trial gets its own query order, shared by all `c` and ratios.
+    # the orders are evaluated lazily, as most trials stop long before the end
+    queries = Permutations(len(database), trials, rng)
 
+    result = {}
+    for c in cs:
+        T = threshold(c, database)
         for s, r in ratios(c).items():
-            print("c: {}, r: {}".format(c, s))
-            s1, s2 = scale(*epsilon(e, r), c)
-            last = 1
-            for i, a in enumerate(alphas.keys()):
-                p = func(a, k, s1, s2, query_array, alphas, T)
-                # catch problems with integration
-                if p > last or (p == last and p < 1) or p <= 0:
-                    break
-                else:
-                    last = p
-                print(total - i, a, p, end='\r')
-                with open('experiments/{}-{} {} {}.txt'.format(data, func.__name__, c, s), 'a') as f:
-                    print(a, p, file=f)
-            print()
-
-
-def write_samples(data):
-    """recreate the experiments from [@svt]"""
-    database = np.loadtxt('data/{}.txt'.format(data), dtype=int)
-
-    for n in range(N):
-        print(n)
-        queries = np.random.permutation(range(len(database)))
-        for c in cs:
-            print(c, end='\r')
-            T = threshold(c, database)
-            for s, r in ratios(c).items():
-                ser = []
-                response = sparse(database, queries, T, e, r, c)
-                ser.append(score_error_rate(database, queries, response, c))
-                with open('experiments/{}-samples {} {}.txt'.format(data, c, s), 'a') as f:
-                    for x in ser:
-                        print(x, file=f)
-        print()
-
-
-def score_error_rate(database, queries, response, c):
+            responses = sparse_batch(database, queries, T, e, r, c, rng=rng)
+            result[c, s] = [score_error_rate(database, queries[i, positions], c)
+                            for i, positions in enumerate(responses)]
+    return result
+
+
+def score_error_rate(database, answers, c):
+    """`answers` are the indices of queries answered positively"""
     best_avg = sum(database[:c]) / c
-    sampled_score = sum(database[q] for q, x in zip(queries, response) if x)
-    sampled_length = len([x for x in response if x])
-    sampled_avg =  sampled_score / sampled_length
+    sampled_avg = np.mean(database[answers])
     return 1 - sampled_avg / best_avg
 
 
@@ -226,7 +505,7 @@ def plot_samples(data, average=mean):
         ys = []
         std = []
         for c in cs:
-            samples = np.loadtxt('experiments/{}-samples {} {}.txt'.format(data, c, s))
+            _, samples = Results(data, 'samples').select(c, s)
             ys.append(average(samples))
             std.append((0, np.std(samples)))
         ax.errorbar(cs, ys, yerr=list(zip(*std)), color=color, capsize=5, fmt='-o', barsabove=True)
@@ -245,13 +524,13 @@ def plot_samples(data, average=mean):
 def plot_accuracy(data, func):
     fig, ax = plt.subplots(figsize=(5,3))
     colors = ['black', 'magenta', 'blue', 'red']
-    counts, array = read_data(data)
+    histogram, _ = read_data(data)
     for s, color in zip(ratios(1).keys(), colors):
         ys = []
         std = []
         for c in cs:
-            results = np.genfromtxt('experiments/{}-{} {} {}.txt'.format(data, func.__name__, c, s), dtype=None)
-            ser, prob = to_pdf(*to_cdf(results, c, array))
+            results = Results(data, func.__name__).select(c, s)
+            ser, prob = to_pdf(*to_cdf(results, c, histogram))
             # need to handle the case where the estimation is too bad
             # and does not lead to a proper distribution
             if isclose(sum(prob), 1, rel_tol=1e-05):
@@ -280,11 +559,10 @@ def plot_accuracy_alpha(data, func):
     xs = []
     ys = []
     pr = []
+    histogram, _ = read_data(data)
     for c in cs:
-        counts, array = read_data(data)
-        results = np.genfromtxt('experiments/{}-{} {} c23.txt'.format(data, func.__name__, c), dtype=None)
-        results = np.atleast_1d(results) # https://stackoverflow.com/a/24247766
-        ser, prob = to_pdf(*to_cdf(results, c, array))
+        results = Results(data, func.__name__).select(c, 'c23')
+        ser, prob = to_pdf(*to_cdf(results, c, histogram))
         prob = discrete_pdf(prob)
         colors = np.zeros((len(ser), 4))
         colors[:,0] = 1 # red
@@ -315,7 +593,7 @@ def plot_accuracy_parameters(c, k):
     for (s, r), color in zip(rs.items(), colors):
         s1, s2 = scale(*epsilon(e, r), c)
         xs = np.arange(MAX)
-        ys = [probability_optimized(x, k, s1, s2) for x in xs]
+        ys = probability_optimized(xs, k, s1, s2)
         ax.plot(xs, ys, color=color, linewidth=2.0, label=s)
     plt.ylim(0, 1)
     plt.xlim(0, MAX)
@@ -328,11 +606,11 @@ def plot_accuracy_parameters(c, k):
 
 def plot_accuracy_slice(data, func, e, c, s):
     fig, ax = plt.subplots(figsize=(7,4))
-    _counts, array = read_data(data)
+    histogram, _ = read_data(data)
     ys = []
     std = []
-    results = np.genfromtxt('experiments/{}-{} {} {}.txt'.format(data, func.__name__, c, s), dtype=None)
-    ser, prob = to_cdf(results, c, array)
+    results = Results(data, func.__name__).select(c, s)
+    ser, prob = to_cdf(results, c, histogram)
     ax.bar(ser, prob, color="red", align='edge',
            label=r"$\mathrm{Pr}(\mathrm{SER} \leq x) \geq 1 - \beta$")
 
@@ -344,17 +622,14 @@ def plot_accuracy_slice(data, func, e, c, s):
     plt.xlabel(r"$x$")
     plt.ylabel(r"$1 - \beta$")
     ax.legend(loc='upper left')
-    plt.title(r"{}, $k = {}, c = {}, \epsilon = {}$".format(datasets[data], len(array), c, e))
+    plt.title(r"{}, $k = {}, c = {}, \epsilon = {}$".format(datasets[data], len(histogram), c, e))
     plt.show()
 
 
 def to_cdf(results, c, database):
-    ser = []
-    prob = []
-    for a, b in results:
-        ser.append(score_error_rate_alpha(database, c, a))
-        prob.append(1 - b)
-    return ser, prob
+    """`results` are the alphas and error probabilities of one series"""
+    alphas, ps = results
+    return score_error_rate_alpha(database, c, alphas), 1 - ps
 
 
 def to_pdf(ser, prob):
@@ -362,12 +637,18 @@ def to_pdf(ser, prob):
 
 
 def score_error_rate_alpha(database, c, a):
-    T = threshold(c, database)
+    """worst score error rate with all answers above T - a, for one or more `a`"""
+    if not isinstance(database, Histogram):
+        database = Histogram.from_values(database)
+    T = database.threshold(c)
+    # in descending order the queries >= T - a come first,
+    # and the worst case takes the last c of them
+    m = database.above(T - np.asarray(a))
     # the length is always c, so we don't need to divide
-    best_case = sum(database[:c])
-    worst_case = sum(database[database >= T - a][-c:])
+    best_case = database.top_sum(c)
+    worst_case = database.top_sum(m) - database.top_sum(np.maximum(m - c, 0))
     return 1 - worst_case / best_case
 
 
 def discrete_pdf(ys):
-    return [ys[0]] + [ys[i] - ys[i-1] for i in range(1, len(ys))]
+    return np.diff(ys, prepend=0)
@@ -10,10 +10,8 @@ from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg as FigCanvas
 from matplotlib.figure import Figure
 from matplotlib.ticker import MaxNLocator
 
-from collections import Counter
 from math import log
 import numpy as np
-from numpy import product
 from scipy.integrate import quad
 
 from algorithms import *
@@ -21,9 +19,10 @@ from accuracy import accuracy_overestimate
 from accuracy import probability_overestimate
 from accuracy import probability_baseline
 from accuracy import probability_optimized
-from accuracy import probability_precise
+from accuracy import probability_table
 from experiments import precise as probability_data
 from experiments import compute_alphas
+from histogram import Histogram
 
 
 class Model(object):
@@ -124,25 +123,25 @@ class Model(object):
 
     def get_probability(self, response, queries):
 
-        def pred(x):
-            return product([self.pr_single_response(r, q, x)
-                            for (r, q) in zip(response, queries)])
+        def log_pred(x):
+            return sum(self.log_pr_single_response(r, q, x)
+                       for (r, q) in zip(response, queries))
 
         def state(x):
-            return self.threshold_dist(x) * pred(x)
+            # sum in log space, so long responses do not underflow to zero
+            return np.exp(self.threshold_dist.logpdf(x) + log_pred(x))
 
         error = 1/1e12
         T_bound = self.threshold_scale * log(1/error)
 
         return quad(state, self.threshold-T_bound, self.threshold+T_bound, points=[self.threshold])[0]
 
-    def pr_single_response(self, is_above, query, threshold):
-        """Pr(query => is_above | threshold_value )"""
-        pr_above = 1 - self.query_dist(query).cdf(threshold)
+    def log_pr_single_response(self, is_above, query, threshold):
+        """log Pr(query => is_above | threshold_value )"""
         if is_above:
-            return pr_above
+            return self.query_dist(query).logsf(threshold)
         else:
-            return 1 - pr_above
+            return self.query_dist(query).logcdf(threshold)
 
     @property
     def pr_diff(self):
@@ -160,7 +159,7 @@ class Model(object):
 
     @property
     def counts(self):
-        return dict(Counter(self.queries))
+        return Histogram.from_values(self.queries)
 
     @property
     def correct_response(self):
@@ -316,11 +315,11 @@ class Accuracy(LineGraph):
         s2 = self.model.query_scale
 
         xs = self.abscissa
-        ax.plot(xs, [probability_overestimate(x, k, s1, s2) for x in xs], color="red", linewidth=2.0, label="overestimate")
-        ax.plot(xs, [probability_baseline(x, k, s1, s2) for x in xs], color="green", linewidth=2.0, label="baseline")
-        ax.plot(xs, [probability_optimized(x, k, s1, s2) for x in xs], color="blue", linewidth=2.0, label="optimized")
+        ax.plot(xs, probability_overestimate(xs, k, s1, s2), color="red", linewidth=2.0, label="overestimate")
+        ax.plot(xs, probability_baseline(xs, k, s1, s2), color="green", linewidth=2.0, label="baseline")
+        ax.plot(xs, probability_optimized(xs, k, s1, s2), color="blue", linewidth=2.0, label="optimized")
         if self.model.compute:
-            ax.plot(xs, [probability_precise(x, k, s1, s2) for x in xs], color="black", linewidth=2.0, label="precise")
+            ax.plot(xs, probability_table(xs, k, s1, s2), color="black", linewidth=2.0, label="precise")
             queries = self.model.queries
             alphas = self.model.alphas
             xs_ = [0] + list(alphas.keys())
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+
+class Histogram(object):
+    """
+    item counts as distinct counts in ascending order and their multiplicities.
+    indexing gives the counts in descending order, like the sorted array of all items,
+    without ever expanding to one element per item.
+    """
+    __slots__ = ('counts', 'multiplicities', 'descending', 'cumulative', 'sums')
+
+    def __init__(self, counts, multiplicities):
+        self.counts = counts
+        self.multiplicities = multiplicities
+        self.descending = counts[::-1]
+        # number and sum of the items in the groups from the top down to each group
+        self.cumulative = np.concatenate([[0], np.cumsum(multiplicities[::-1])])
+        self.sums = np.concatenate([[0], np.cumsum((counts * multiplicities)[::-1])])
+
+    @classmethod
+    def from_values(cls, values):
+        counts, multiplicities = np.unique(values, return_counts=True)
+        return cls(counts, multiplicities)
+
+    def __len__(self):
+        return int(self.cumulative[-1])
+
+    def __getitem__(self, key):
+        """count of the item at one or more positions in descending order"""
+        if isinstance(key, slice):
+            key = np.arange(*key.indices(len(self)))
+        i = np.asarray(key)
+        i = np.where(i < 0, i + len(self), i)
+        if np.any((i < 0) | (i >= len(self))):
+            raise IndexError(key)
+        group = np.searchsorted(self.cumulative, i, side='right') - 1
+        return self.descending[group][()]
+
+    def threshold(self, c):
+        """threshold between the `c`-th and the next largest count"""
+        return (self[c-1] + self[c])/2
+
+    def above(self, x):
+        """number of items with count >= `x`"""
+        groups = len(self.counts) - np.searchsorted(self.counts, x, side='left')
+        return self.cumulative[groups][()]
+
+    def below(self, x):
+        """number of items with count <= `x`"""
+        groups = len(self.counts) - np.searchsorted(self.counts, x, side='right')
+        return len(self) - self.cumulative[groups][()]
+
+    def top_sum(self, n):
+        """sum of the `n` largest counts"""
+        group = np.searchsorted(self.cumulative, n, side='right') - 1
+        partial = self.descending[np.minimum(group, len(self.counts) - 1)]
+        return (self.sums[group] + (n - self.cumulative[group]) * partial)[()]
+
+    def sample(self, size=None, rng=None):
+        """counts of items drawn uniformly at random, with replacement"""
+        if rng is None:
+            rng = np.random.default_rng()
+        return self[rng.integers(len(self), size=size)]
+
+
+def take(database, queries):
+    """answers to `queries` from a sorted array of counts or a `Histogram`"""
+    if isinstance(database, Histogram):
+        return database[queries]
+    return np.take(database, queries)
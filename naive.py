@@ -1,30 +1,108 @@
 #!/usr/bin/env python3
 
-from numpy.random import laplace
+import numpy as np
 from algorithms import epsilon as get_epsilon
 from algorithms import scale
+from algorithms import Laplace
+from histogram import take
 
 
-def Lap(scale):
-    return laplace(scale=scale)
+def Lap(scale, size=None, rng=None):
+    """
+    Laplace noise from generator `rng`.
+    without a generator we fall back to the global `numpy.random` state.
+    """
+    if rng is None:
+        rng = np.random
+    return rng.laplace(scale=scale, size=size)
 
 
-def report_noisy_max(database, queries, epsilon):
-    responses = [database[q] + Lap(1/epsilon) for q in queries]
+def streams(seed, workers):
+    """independent random generators for `workers`, all derived from `seed`"""
+    children = np.random.SeedSequence(seed).spawn(workers)
+    return [np.random.default_rng(s) for s in children]
+
+
+class Permutations(object):
+    """
+    one pseudo-random permutation of `range(n)` per trial, evaluated lazily.
+    each is a keyed Feistel network on the smallest even number of bits covering `n`,
+    with cycle walking to stay inside `range(n)`, so any position costs O(1) time and memory.
+    indexing with `[rows, columns]` gives the query indices at those positions,
+    for every combination of rows and columns.
+    """
+    rounds = 6
+
+    def __init__(self, n, trials, rng=None):
+        if rng is None:
+            rng = np.random.default_rng()
+        self.n = n
+        self.half = max(1, (int(n - 1).bit_length() + 1) // 2)
+        self.keys = rng.integers(0, 2**63, (trials, self.rounds), dtype=np.uint64)
+        self.shape = (trials, n)
+        self.ndim = 2
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, key):
+        rows, columns = key
+        if isinstance(columns, slice):
+            columns = np.arange(*columns.indices(self.n))
+        columns = np.asarray(columns, dtype=np.uint64)
+        keys = np.expand_dims(self.keys[rows], -2)
+        shape = np.broadcast_shapes(keys.shape[:-1], columns.shape)
+        x = np.broadcast_to(columns, shape)
+        keys = np.broadcast_to(keys, shape + (self.rounds,))
+        x = self.encrypt(x, keys)
+        # walk the cycle until we land inside the range again
+        outside = np.flatnonzero(x >= self.n)
+        while len(outside):
+            flat = x.reshape(-1)
+            flat[outside] = self.encrypt(flat[outside], keys.reshape(-1, self.rounds)[outside])
+            outside = outside[flat[outside] >= self.n]
+        return x.astype(int)
+
+    def encrypt(self, x, keys):
+        h = np.uint64(self.half)
+        mask = np.uint64((1 << self.half) - 1)
+        left, right = x >> h, x & mask
+        for r in range(self.rounds):
+            left, right = right, left ^ (mix(right ^ keys[..., r]) & mask)
+        return (left << h) | right
+
+
+def mix(z):
+    """splitmix64 finalizer, a cheap bijective hash on 64 bit integers"""
+    z = z + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def report_noisy_max(database, queries, epsilon, rng=None):
+    responses = [database[q] + Lap(1/epsilon, rng=rng) for q in queries]
     return responses.index(max(responses))
 
 
+def report_noisy_max_batch(database, queries, epsilon, trials=1, rng=None):
+    """index of the noisy maximum in `queries` for each of `trials` runs"""
+    values = take(database, queries)
+    responses = values + Lap(1/epsilon, (trials, len(values)), rng)
+    return np.argmax(responses, axis=1)
+
+
 def sparse(database, queries, threshold, epsilon, ratio,
-           c=1, sensitivity=1, monotonic=True):
+           c=1, sensitivity=1, monotonic=True, rng=None):
     e1, e2 = get_epsilon(epsilon, ratio)
     s1, s2 = scale(e1, e2, c, sensitivity, monotonic)
 
     result = []
-    r = Lap(s1)
+    r = Lap(s1, rng=rng)
     count = 0
 
     for q in queries:
-        n = Lap(s2)
+        n = Lap(s2, rng=rng)
         if database[q] + n >= threshold + r:
             result.append(True)
             count += 1
@@ -34,3 +112,108 @@ def sparse(database, queries, threshold, epsilon, ratio,
             result.append(False)
     return result
 
+
+def sparse_stream(answers, threshold, epsilon, ratio,
+                  c=1, sensitivity=1, monotonic=True, rng=None):
+    """
+    consume query `answers` lazily from any iterable and yield the position
+    of every positive answer, stopping after `c` of them.
+    """
+    e1, e2 = get_epsilon(epsilon, ratio)
+    s1, s2 = scale(e1, e2, c, sensitivity, monotonic)
+
+    r = Lap(s1, rng=rng)
+    count = 0
+
+    for i, answer in enumerate(answers):
+        if answer + Lap(s2, rng=rng) >= threshold + r:
+            yield i
+            count += 1
+            if count >= c:
+                return
+
+
+def sparse_runs(values, lengths, threshold, epsilon, ratio,
+                c=1, sensitivity=1, monotonic=True, rng=None):
+    """
+    run `sparse` on queries given as runs of `lengths` consecutive queries
+    with the same answer in `values`, and return the positions of the positive answers.
+
+    given the threshold noise, every query in a run is positive independently
+    with the same probability, so we jump straight to the next positive
+    by drawing a geometric waiting time. the output has the same distribution
+    as the per-query loop, at a cost proportional to the runs visited.
+    """
+    e1, e2 = get_epsilon(epsilon, ratio)
+    s1, s2 = scale(e1, e2, c, sensitivity, monotonic)
+    if rng is None:
+        rng = np.random
+
+    r = Lap(s1, rng=rng)
+    result = []
+    start = 0
+
+    for value, length in zip(values, lengths):
+        # probability of a positive answer, accurate even when it is tiny
+        p = np.exp(Laplace(s2, value).logsf(threshold + r))
+        position = 0
+        while True:
+            # number of queries up to and including the next positive one
+            with np.errstate(divide='ignore'):
+                wait = np.floor(np.log(1 - rng.random()) / np.log1p(-p)) + 1
+            position += wait
+            if position > length:
+                break
+            result.append(start + int(position) - 1)
+            if len(result) >= c:
+                return result
+        start += length
+    return result
+
+
+def sparse_batch(database, queries, threshold, epsilon, ratio,
+                 c=1, sensitivity=1, monotonic=True, trials=1, block=1024,
+                 rng=None):
+    """
+    run `sparse` for many trials at once and return, for each trial,
+    the positions in `queries` of the positive answers.
+
+    `queries` is either one order for all trials, or a 2-D array or
+    `Permutations` with one order per trial. noise is drawn for `block` queries of all unfinished
+    trials at a time, so memory stays bounded and we stop as soon as every
+    trial has collected `c` positive answers.
+    """
+    e1, e2 = get_epsilon(epsilon, ratio)
+    s1, s2 = scale(e1, e2, c, sensitivity, monotonic)
+
+    if not isinstance(queries, Permutations):
+        queries = np.asarray(queries)
+    if queries.ndim == 2:
+        trials = len(queries)
+    length = queries.shape[-1]
+
+    r = Lap(s1, trials, rng)
+    count = np.zeros(trials, dtype=int)
+    result = [[] for _ in range(trials)]
+
+    for start in range(0, length, block):
+        active = np.flatnonzero(count < c)
+        if not len(active):
+            break
+        end = min(start + block, length)
+        if queries.ndim == 2:
+            values = take(database, queries[active, start:end])
+        else:
+            values = take(database, queries[start:end])
+        n = Lap(s2, (len(active), end - start), rng)
+        positive = values + n >= threshold + r[active, np.newaxis]
+        # cut off each trial after its c-th positive answer
+        total = count[active, np.newaxis] + np.cumsum(positive, axis=1)
+        positive &= total <= c
+        rows, columns = np.nonzero(positive)
+        splits = np.searchsorted(rows, range(1, len(active)))
+        for i, positions in zip(active, np.split(columns + start, splits)):
+            result[i].append(positions)
+        count[active] = total[:, -1]
+
+    return [np.concatenate(x) if x else np.empty(0, dtype=int) for x in result]
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import os
+from queue import Queue
+from threading import Thread
+
+
+# one raw binary file per column, so readers only touch the columns they need
+columns = [
+    ('c', np.int32),
+    ('ratio', 'S3'),
+    ('alpha', np.int64),
+    ('value', np.float64),
+]
+
+
+class Results(object):
+    """
+    append-only columnar table of experiment results with columns `c`, `ratio`,
+    `alpha` and `value`, stored in `experiments/{data}-{name}/`.
+    series without an alpha, such as samples, store -1 there.
+    """
+
+    def __init__(self, data, name, root='experiments'):
+        self.path = os.path.join(root, '{}-{}'.format(data, name))
+
+    def filename(self, column):
+        return os.path.join(self.path, column + '.bin')
+
+    def __len__(self):
+        # an interrupted append may leave some columns longer than others,
+        # but the first `len` rows are complete in all of them
+        lengths = []
+        for name, dtype in columns:
+            if not os.path.exists(self.filename(name)):
+                return 0
+            lengths.append(os.path.getsize(self.filename(name)) // np.dtype(dtype).itemsize)
+        return min(lengths)
+
+    def column(self, name):
+        """memory-mapped view of one column"""
+        dtype = dict(columns)[name]
+        length = len(self)
+        if not length:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self.filename(name), dtype=dtype, mode='r', shape=(length,))
+
+    def select(self, c, ratio):
+        """alphas and values of one series, in the order they were written"""
+        rows = np.flatnonzero((self.column('c') == c) & (self.column('ratio') == ratio.encode()))
+        return np.asarray(self.column('alpha')[rows]), np.asarray(self.column('value')[rows])
+
+    def append(self, c, ratio, alpha, value):
+        """append rows, broadcasting the arguments against each other"""
+        self.write(rows(c, ratio, alpha, value))
+
+    def write(self, data):
+        """append one array per column"""
+        os.makedirs(self.path, exist_ok=True)
+        length = len(self)
+        for (name, dtype), x in zip(columns, data):
+            with open(self.filename(name), 'ab') as f:
+                # drop rows left over from an interrupted append
+                f.truncate(length * np.dtype(dtype).itemsize)
+                x.tofile(f)
+
+
+def rows(c, ratio, alpha, value):
+    """one flat array per column, broadcasting the arguments against each other"""
+    data = np.broadcast_arrays(c, ratio, alpha, value)
+    return [np.ravel(x).astype(dtype) for (_, dtype), x in zip(columns, data)]
+
+
+class Writer(object):
+    """
+    append to `Results` from a background thread, so the caller never waits for the disk.
+    rows are buffered until `buffer` of them are pending or the queue runs empty.
+    callbacks passed to `then` run once the rows queued before them are written.
+    after a failure nothing more is written, and `close` raises the error.
+    """
+
+    def __init__(self, results, buffer=1 << 16):
+        self.results = results
+        self.buffer = buffer
+        self.queue = Queue()
+        self.error = None
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def append(self, c, ratio, alpha, value):
+        self.queue.put((rows(c, ratio, alpha, value), None))
+
+    def then(self, done):
+        """call `done` once everything appended so far is written"""
+        self.queue.put((None, done))
+
+    def run(self):
+        pending = []
+        done = None
+        while True:
+            item = self.queue.get()
+            if item is not None:
+                data, done = item
+                if data is not None:
+                    pending.append(data)
+            if self.error is not None:
+                # keep draining the queue after a failure, so callers never block
+                pending = []
+                if item is None:
+                    return
+                continue
+            try:
+                size = sum(len(data[0]) for data in pending)
+                if item is None or done or size >= self.buffer or self.queue.empty():
+                    if pending:
+                        self.results.write([np.concatenate(x) for x in zip(*pending)])
+                    pending = []
+                if item is None:
+                    return
+                if done:
+                    done()
+            except Exception as e:
+                self.error = e
+                if item is None:
+                    return
+
+    def close(self):
+        """wait for all rows to be written, and raise the first error that occurred"""
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()